@@ -1,21 +1,47 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Index, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
 from datetime import datetime
 import os
 
 # Configuration de la base de données
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./radiology_dapp.db")
 
-# Créer le moteur de base de données
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+def get_async_database_url(url: str) -> str:
+    """Convertit une URL de connexion vers son driver asynchrone (aiosqlite, asyncpg)"""
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+ASYNC_DATABASE_URL = get_async_database_url(DATABASE_URL)
+
+# Options du moteur : SQLite n'utilise pas de pool réseau, les autres bases
+# gardent un pool de connexions dimensionné pour la charge
+if DATABASE_URL.startswith("sqlite"):
+    engine_options = {"connect_args": {"check_same_thread": False}}
+else:
+    engine_options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": 30,
+        "pool_pre_ping": True,
+        "pool_recycle": 3600,
+    }
+
+# Créer le moteur de base de données asynchrone
+engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options)
+
+# Créer la session asynchrone
+SessionLocal = async_sessionmaker(
+    bind=engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
 )
 
-# Créer la session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
 # Créer la base pour les modèles
 Base = declarative_base()
 
@@ -54,11 +80,18 @@ class Patient(Base):
 class Procedure(Base):
     """Modèle acte médical (métadonnées locales)"""
     __tablename__ = "procedures"
+    __table_args__ = (
+        # Sert les actes d'un patient (bundle FHIR) par un parcours d'index
+        Index("ix_procedures_patient_hash_id", "patient_hash", "id"),
+        # Historique d'un patient trié par date (parcouru à rebours pour ORDER BY ... DESC)
+        Index("ix_procedures_patient_hash_created_at", "patient_hash", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     blockchain_id = Column(Integer, unique=True, index=True)  # ID sur la blockchain
+    # Pas d'index propre : les index composites ci-dessus commencent par patient_hash
     patient_hash = Column(String, ForeignKey("patients.patient_hash"))
-    practitioner_id = Column(Integer, ForeignKey("users.id"))
+    practitioner_id = Column(Integer, ForeignKey("users.id"), index=True)
     procedure_type = Column(String, index=True)
     duration = Column(Integer)  # en minutes
     consent_hash = Column(String)
@@ -70,6 +103,7 @@ class Procedure(Base):
     # Relations
     patient = relationship("Patient", back_populates="procedures")
     practitioner = relationship("User", back_populates="procedures")
+    consents = relationship("Consent", back_populates="procedure")
 
 class Consent(Base):
     """Modèle consentement patient"""
@@ -83,21 +117,61 @@ class Consent(Base):
     expires_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Relations
+    procedure = relationship("Procedure", back_populates="consents")
+
 class FHIRResource(Base):
     """Modèle ressource FHIR"""
     __tablename__ = "fhir_resources"
+    __table_args__ = (
+        # Listing filtré par type et paginé par ID
+        Index("ix_fhir_resources_type_id", "resource_type", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     resource_type = Column(String, index=True)  # Claim, Patient, Practitioner, etc.
     resource_id = Column(String, index=True)
+    source_key = Column(String, unique=True, index=True)  # Hash type + ID + versions des sources
     fhir_data = Column(Text)  # JSON FHIR complet
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+# Index retirés des modèles, supprimés des bases existantes
+OBSOLETE_INDEXES = {
+    "procedures": ("ix_procedures_patient_hash",),  # redondant avec ix_procedures_patient_hash_id
+}
+
+def upgrade_schema(connection):
+    """Complète une base existante : colonnes et index ajoutés aux modèles depuis sa création"""
+    # create_all ne modifie jamais une table existante
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    existing_tables = set(inspector.get_table_names())
+    
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        
+        # Ajouter les colonnes manquantes (nullables, leurs contraintes d'unicité passent par les index)
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} "
+                    f"ADD COLUMN {preparer.quote(column.name)} {column.type.compile(dialect=connection.dialect)}"
+                ))
+        
+        # Créer les index manquants (dont l'index unique de fhir_resources.source_key)
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+        
+        # Supprimer les index devenus redondants
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index_name in OBSOLETE_INDEXES.get(table.name, ()):
+            if index_name in existing_indexes:
+                connection.execute(text(f"DROP INDEX {preparer.quote(index_name)}"))
+
 # Fonction pour obtenir la session de base de données
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
\ No newline at end of file
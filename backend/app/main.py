@@ -1,12 +1,16 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer
 from contextlib import asynccontextmanager
 import uvicorn
+import logging
+import logging.handlers
 import os
+import queue
 from dotenv import load_dotenv
 
-from app.database import engine, Base
+from app.database import engine, Base, upgrade_schema
 from app.routers import procedures, auth, fhir
 from app.utils.blockchain import init_web3
 from app.utils.auth import get_current_user
@@ -14,6 +18,17 @@ from app.utils.auth import get_current_user
 # Charger les variables d'environnement
 load_dotenv()
 
+# Configuration de la journalisation : les handlers ne font qu'empiler les messages,
+# l'écriture sur la sortie standard est faite par un thread dédié (QueueListener)
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+
+logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger("app")
+
 # Configuration de l'application
 app_config = {
     "title": "Radiology DApp API",
@@ -27,26 +42,33 @@ app_config = {
 async def lifespan(app: FastAPI):
     """Gestion du cycle de vie de l'application"""
     # Démarrage
-    print("🚀 Démarrage de l'API Radiology DApp...")
+    log_listener.start()
+    logger.info("🚀 Démarrage de l'API Radiology DApp...")
     
     # Initialiser la base de données
-    Base.metadata.create_all(bind=engine)
-    print("✅ Base de données initialisée")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+    logger.info("✅ Base de données initialisée")
+    
+    # Créer le répertoire des consentements une seule fois
+    procedures.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
     
     # Initialiser Web3
     try:
         init_web3()
-        print("✅ Connexion Web3 établie")
+        logger.info("✅ Connexion Web3 établie")
     except Exception as e:
-        print(f"⚠️ Erreur Web3: {e}")
+        logger.warning("⚠️ Erreur Web3: %s", e)
     
     yield
     
     # Arrêt
-    print("🛑 Arrêt de l'API Radiology DApp...")
+    logger.info("🛑 Arrêt de l'API Radiology DApp...")
+    log_listener.stop()
 
 # Créer l'application FastAPI
-app = FastAPI(**app_config, lifespan=lifespan)
+app = FastAPI(**app_config, default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Configuration CORS
 app.add_middleware(
@@ -116,10 +138,16 @@ async def api_info():
     }
 
 if __name__ == "__main__":
+    # WEB_CONCURRENCY : nombre de workers (recommandé : 2 * cœurs + 1 en production)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        # Le rechargement automatique n'est disponible qu'avec un seul worker
+        reload=os.getenv("UVICORN_RELOAD", "false").lower() == "true" and workers == 1,
         log_level="info"
     )
\ No newline at end of file
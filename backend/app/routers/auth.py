@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 
-from app.database import get_db
-from app.schemas.auth import User, UserCreate, Token, UserLogin
+from app.database import get_db, User as UserModel
+from app.schemas.auth import User, UserCreate, UserPage, Token, UserLogin
 from app.utils.auth import (
     authenticate_user,
     create_access_token,
@@ -21,18 +22,18 @@ router = APIRouter()
 @router.post("/register", response_model=User)
 async def register(
     user: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Enregistre un nouvel utilisateur"""
     # Vérifier si l'utilisateur existe déjà
-    db_user = get_user_by_username(db, username=user.username)
+    db_user = await get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=400,
             detail="Nom d'utilisateur déjà utilisé"
         )
     
-    db_user = get_user_by_email(db, email=user.email)
+    db_user = await get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=400,
@@ -40,7 +41,7 @@ async def register(
         )
     
     # Créer l'utilisateur
-    return create_user(
+    return await create_user(
         db=db,
         username=user.username,
         email=user.email,
@@ -52,10 +53,10 @@ async def register(
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Authentifie un utilisateur et retourne un token JWT"""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -65,7 +66,7 @@ async def login(
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     
     return {
@@ -77,10 +78,10 @@ async def login(
 @router.post("/login-json", response_model=Token)
 async def login_json(
     user_credentials: UserLogin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Authentifie un utilisateur avec JSON et retourne un token JWT"""
-    user = authenticate_user(db, user_credentials.username, user_credentials.password)
+    user = await authenticate_user(db, user_credentials.username, user_credentials.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -90,7 +91,7 @@ async def login_json(
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     
     return {
@@ -104,25 +105,32 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
     """Récupère les informations de l'utilisateur connecté"""
     return current_user
 
-@router.get("/users", response_model=list[User])
+@router.get("/users", response_model=UserPage)
 async def get_users(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
+    after: int = 0,
+    limit: int = Query(100, ge=1),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin)
 ):
-    """Récupère la liste des utilisateurs (admin seulement)"""
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+    """Récupère la liste des utilisateurs par pages (admin seulement)"""
+    result = await db.scalars(
+        select(UserModel).where(UserModel.id > after).order_by(UserModel.id).limit(limit)
+    )
+    users = result.all()
+    
+    return {
+        "items": users,
+        "next_cursor": users[-1].id if users and len(users) == limit else None
+    }
 
 @router.get("/users/{user_id}", response_model=User)
 async def get_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin)
 ):
     """Récupère un utilisateur par son ID (admin seulement)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(UserModel, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     return user
@@ -131,13 +139,13 @@ async def get_user(
 async def update_user(
     user_id: int,
     user_update: dict,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin)
 ):
     """Met à jour un utilisateur (admin seulement)"""
     from app.utils.auth import update_user as update_user_func
     
-    user = update_user_func(db, user_id, **user_update)
+    user = await update_user_func(db, user_id, **user_update)
     if user is None:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     return user
@@ -145,13 +153,13 @@ async def update_user(
 @router.delete("/users/{user_id}")
 async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin)
 ):
     """Supprime un utilisateur (admin seulement)"""
     from app.utils.auth import delete_user as delete_user_func
     
-    success = delete_user_func(db, user_id)
+    success = await delete_user_func(db, user_id)
     if not success:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     
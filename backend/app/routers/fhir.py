@@ -1,14 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
-import json
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from cachetools import TTLCache
+from typing import AsyncIterator, Callable, List, Optional
+import hashlib
+import orjson
 from datetime import datetime
+from pydantic import ValidationError
 
-from app.database import get_db, Procedure, Patient, User, FHIRResource
+from app.database import get_db, SessionLocal, Procedure, Patient, User, FHIRResource
 from app.schemas.auth import User as UserSchema
+from app.schemas.fhir import FHIR_RESOURCE_MODELS, FHIRResourceOut
 from app.utils.auth import get_current_practitioner
 from app.utils.fhir_converter import (
     create_fhir_claim,
+    create_fhir_claims_batch,
     create_fhir_patient,
     create_fhir_practitioner,
     create_fhir_coverage
@@ -16,184 +25,297 @@ from app.utils.fhir_converter import (
 
 router = APIRouter()
 
+# Cache des réponses GET en lecture seule (par worker), vidé à chaque écriture de ressource
+RESPONSE_CACHE_TTL_SECONDS = 60
+_response_cache = TTLCache(maxsize=1024, ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+# Taille des lots lus et stockés lors de la génération d'un bundle patient
+STORE_BATCH_SIZE = 100
+
+def _response_cache_key(request: Request, current_user: UserSchema) -> tuple:
+    """Clé du cache de réponses : chemin, paramètres et utilisateur"""
+    return (request.url.path, request.url.query, current_user.id)
+
+def _dump_fhir(resource: dict) -> str:
+    """Sérialise une ressource FHIR pour le stockage (JSON compact)"""
+    return orjson.dumps(resource).decode()
+
+def _source_key(resource_type: str, resource_id: str, *versions: datetime) -> str:
+    """Clé de déduplication : type, identifiant et dates de mise à jour des sources"""
+    raw = ":".join([resource_type, resource_id, *(v.isoformat() for v in versions)])
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+async def _get_or_create_resource(
+    db: AsyncSession,
+    resource_type: str,
+    resource_id: str,
+    source_key: str,
+    build: Callable[[], dict]
+) -> Response:
+    """Retourne la ressource déjà générée pour cette version des sources, ou la génère et la stocke"""
+    fhir_data = await db.scalar(
+        select(FHIRResource.fhir_data).where(FHIRResource.source_key == source_key)
+    )
+    
+    if fhir_data is None:
+        fhir_data = _dump_fhir(build())
+        db.add(FHIRResource(
+            resource_type=resource_type,
+            resource_id=resource_id,
+            source_key=source_key,
+            fhir_data=fhir_data
+        ))
+        try:
+            await db.commit()
+            _response_cache.clear()
+        except IntegrityError:
+            # Déjà insérée par une requête concurrente
+            await db.rollback()
+    
+    return Response(content=fhir_data, media_type="application/json")
+
 @router.get("/claim/{procedure_id}")
 async def generate_fhir_claim(
     procedure_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: UserSchema = Depends(get_current_practitioner)
 ):
     """Génère un claim FHIR pour un acte spécifique"""
-    # Récupérer l'acte
-    procedure = db.query(Procedure).filter(Procedure.id == procedure_id).first()
+    # Récupérer l'acte avec son patient et son praticien en une seule requête
+    procedure = await db.scalar(
+        select(Procedure).options(
+            joinedload(Procedure.patient),
+            joinedload(Procedure.practitioner)
+        ).where(Procedure.id == procedure_id)
+    )
     if not procedure:
         raise HTTPException(status_code=404, detail="Acte non trouvé")
     
-    # Récupérer le patient
-    patient = db.query(Patient).filter(Patient.patient_hash == procedure.patient_hash).first()
+    patient = procedure.patient
     if not patient:
         raise HTTPException(status_code=404, detail="Patient non trouvé")
     
-    # Récupérer le praticien
-    practitioner = db.query(User).filter(User.id == procedure.practitioner_id).first()
+    practitioner = procedure.practitioner
     if not practitioner:
         raise HTTPException(status_code=404, detail="Praticien non trouvé")
     
-    # Générer le claim FHIR
-    claim = create_fhir_claim(procedure, patient, practitioner)
-    
-    # Sauvegarder en base
-    fhir_resource = FHIRResource(
-        resource_type="Claim",
-        resource_id=f"claim-{procedure_id}",
-        fhir_data=json.dumps(claim, indent=2)
+    resource_id = f"claim-{procedure_id}"
+    return await _get_or_create_resource(
+        db,
+        "Claim",
+        resource_id,
+        _source_key("Claim", resource_id, procedure.updated_at, patient.created_at, practitioner.updated_at),
+        lambda: create_fhir_claim(procedure, patient, practitioner)
     )
-    
-    db.add(fhir_resource)
-    db.commit()
-    
-    return claim
 
 @router.get("/patient/{patient_hash}")
 async def generate_fhir_patient(
     patient_hash: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: UserSchema = Depends(get_current_practitioner)
 ):
     """Génère une ressource Patient FHIR"""
-    patient = db.query(Patient).filter(Patient.patient_hash == patient_hash).first()
+    patient = await db.scalar(select(Patient).where(Patient.patient_hash == patient_hash))
     if not patient:
         raise HTTPException(status_code=404, detail="Patient non trouvé")
     
-    fhir_patient = create_fhir_patient(patient)
-    
-    # Sauvegarder en base
-    fhir_resource = FHIRResource(
-        resource_type="Patient",
-        resource_id=f"patient-{patient_hash}",
-        fhir_data=json.dumps(fhir_patient, indent=2)
+    resource_id = f"patient-{patient_hash}"
+    return await _get_or_create_resource(
+        db,
+        "Patient",
+        resource_id,
+        _source_key("Patient", resource_id, patient.created_at),
+        lambda: create_fhir_patient(patient)
     )
-    
-    db.add(fhir_resource)
-    db.commit()
-    
-    return fhir_patient
 
 @router.get("/practitioner/{practitioner_id}")
 async def generate_fhir_practitioner(
     practitioner_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: UserSchema = Depends(get_current_practitioner)
 ):
     """Génère une ressource Practitioner FHIR"""
-    practitioner = db.query(User).filter(User.id == practitioner_id).first()
+    practitioner = await db.get(User, practitioner_id)
     if not practitioner:
         raise HTTPException(status_code=404, detail="Praticien non trouvé")
     
-    fhir_practitioner = create_fhir_practitioner(practitioner)
-    
-    # Sauvegarder en base
-    fhir_resource = FHIRResource(
-        resource_type="Practitioner",
-        resource_id=f"practitioner-{practitioner_id}",
-        fhir_data=json.dumps(fhir_practitioner, indent=2)
+    resource_id = f"practitioner-{practitioner_id}"
+    return await _get_or_create_resource(
+        db,
+        "Practitioner",
+        resource_id,
+        _source_key("Practitioner", resource_id, practitioner.updated_at),
+        lambda: create_fhir_practitioner(practitioner)
     )
+
+async def _store_new_resources(db: AsyncSession, resources: List[dict]) -> None:
+    """Insère en un seul INSERT les ressources pas encore stockées pour cette version des sources"""
+    existing = set(await db.scalars(
+        select(FHIRResource.source_key)
+        .where(FHIRResource.source_key.in_([r["source_key"] for r in resources]))
+    ))
+    new_resources = [r for r in resources if r["source_key"] not in existing]
+    if new_resources:
+        try:
+            await db.execute(insert(FHIRResource), new_resources)
+            await db.commit()
+            _response_cache.clear()
+        except IntegrityError:
+            # Déjà insérées par une requête concurrente
+            await db.rollback()
+
+def _bundle_entry(resource_json: bytes, full_url: str) -> bytes:
+    """Entrée de bundle construite autour d'une ressource déjà sérialisée"""
+    return b'{"resource":' + resource_json + b',"fullUrl":' + orjson.dumps(full_url) + b"}"
+
+async def _stream_patient_bundle(patient: Patient) -> AsyncIterator[bytes]:
+    """Produit le bundle FHIR d'un patient entrée par entrée"""
+    patient_hash = patient.patient_hash
     
-    db.add(fhir_resource)
-    db.commit()
+    # En-tête du bundle, le tableau "entry" est ouvert puis rempli au fil de l'eau
+    header = orjson.dumps({
+        "resourceType": "Bundle",
+        "id": f"bundle-patient-{patient_hash}",
+        "type": "collection",
+        "timestamp": datetime.utcnow().isoformat()
+    })
+    yield header[:-1] + b',"entry":['
+    
+    # Chaque ressource est sérialisée une seule fois, pour la réponse et pour le stockage
+    patient_json = orjson.dumps(create_fhir_patient(patient))
+    yield _bundle_entry(patient_json, f"Patient/{patient_hash}")
+    patient_id = f"patient-{patient_hash}"
+    resources = [{
+        "resource_type": "Patient",
+        "resource_id": patient_id,
+        "source_key": _source_key("Patient", patient_id, patient.created_at),
+        "fhir_data": patient_json.decode()
+    }]
     
-    return fhir_practitioner
+    async with SessionLocal() as db:
+        # Parcourir les actes du patient avec leur praticien (une seule jointure),
+        # par lots de lignes pour ne pas charger tous les objets ORM à la fois
+        procedures = await db.stream_scalars(
+            select(Procedure).options(
+                joinedload(Procedure.practitioner)
+            ).where(Procedure.patient_hash == patient_hash)
+            .execution_options(yield_per=STORE_BATCH_SIZE)
+        )
+        
+        # Ajouter les ressources Claim, construites et envoyées lot par lot
+        async for partition in procedures.partitions():
+            partition = [procedure for procedure in partition if procedure.practitioner]
+            practitioners = {procedure.practitioner_id: procedure.practitioner for procedure in partition}
+            claims = create_fhir_claims_batch(partition, patient, practitioners)
+            
+            for procedure, claim in zip(partition, claims):
+                claim_id = claim["id"]
+                claim_json = orjson.dumps(claim)
+                yield b"," + _bundle_entry(claim_json, f"Claim/{claim_id}")
+                resources.append({
+                    "resource_type": "Claim",
+                    "resource_id": claim_id,
+                    "source_key": _source_key(
+                        "Claim", claim_id,
+                        procedure.updated_at, patient.created_at, procedure.practitioner.updated_at
+                    ),
+                    "fhir_data": claim_json.decode()
+                })
+        
+        # Stocker une fois le curseur de lecture fermé (SQLite refuse d'écrire pendant
+        # la lecture), par lots pour borner la clause IN
+        for start in range(0, len(resources), STORE_BATCH_SIZE):
+            await _store_new_resources(db, resources[start:start + STORE_BATCH_SIZE])
+    
+    yield b"]}"
 
 @router.get("/patient/{patient_hash}/bundle")
 async def generate_patient_bundle(
     patient_hash: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: UserSchema = Depends(get_current_practitioner)
 ):
-    """Génère un bundle FHIR complet pour un patient"""
+    """Génère un bundle FHIR complet pour un patient (réponse envoyée en flux)"""
     # Récupérer le patient
-    patient = db.query(Patient).filter(Patient.patient_hash == patient_hash).first()
+    patient = await db.scalar(select(Patient).where(Patient.patient_hash == patient_hash))
     if not patient:
         raise HTTPException(status_code=404, detail="Patient non trouvé")
     
-    # Récupérer tous les actes du patient
-    procedures = db.query(Procedure).filter(Procedure.patient_hash == patient_hash).all()
-    
-    # Créer le bundle FHIR
-    bundle = {
-        "resourceType": "Bundle",
-        "id": f"bundle-patient-{patient_hash}",
-        "type": "collection",
-        "timestamp": datetime.utcnow().isoformat(),
-        "entry": []
-    }
-    
-    # Ajouter la ressource Patient
-    fhir_patient = create_fhir_patient(patient)
-    bundle["entry"].append({
-        "resource": fhir_patient,
-        "fullUrl": f"Patient/{patient_hash}"
-    })
-    
-    # Ajouter les ressources Claim pour chaque acte
-    for procedure in procedures:
-        practitioner = db.query(User).filter(User.id == procedure.practitioner_id).first()
-        if practitioner:
-            claim = create_fhir_claim(procedure, patient, practitioner)
-            bundle["entry"].append({
-                "resource": claim,
-                "fullUrl": f"Claim/{claim['id']}"
-            })
-    
-    return bundle
+    return StreamingResponse(_stream_patient_bundle(patient), media_type="application/json")
 
-@router.get("/resources")
+@router.get("/resources", response_model=List[FHIRResourceOut], response_model_exclude_none=True)
 async def get_fhir_resources(
+    request: Request,
     resource_type: Optional[str] = None,
-    skip: int = 0,
+    after_id: Optional[int] = None,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    include_data: bool = False,
+    db: AsyncSession = Depends(get_db),
     current_user: UserSchema = Depends(get_current_practitioner)
 ):
-    """Récupère les ressources FHIR stockées"""
-    query = db.query(FHIRResource)
+    """Récupère les ressources FHIR stockées (pagination par curseur sur l'ID)"""
+    cache_key = _response_cache_key(request, current_user)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    # Le JSON complet n'est chargé que s'il est demandé
+    columns = [
+        FHIRResource.id,
+        FHIRResource.resource_type,
+        FHIRResource.resource_id,
+        FHIRResource.created_at,
+        FHIRResource.updated_at
+    ]
+    if include_data:
+        columns.append(FHIRResource.fhir_data)
+    
+    query = select(*columns)
     
     if resource_type:
-        query = query.filter(FHIRResource.resource_type == resource_type)
+        query = query.where(FHIRResource.resource_type == resource_type)
     
-    resources = query.offset(skip).limit(limit).all()
+    if after_id is not None:
+        query = query.where(FHIRResource.id > after_id)
     
-    result = []
-    for resource in resources:
-        result.append({
-            "id": resource.id,
-            "resource_type": resource.resource_type,
-            "resource_id": resource.resource_id,
-            "fhir_data": json.loads(resource.fhir_data),
-            "created_at": resource.created_at.isoformat(),
-            "updated_at": resource.updated_at.isoformat()
-        })
+    # Les lignes sont validées directement par FHIRResourceOut (dates sérialisées nativement)
+    rows = await db.execute(query.order_by(FHIRResource.id).limit(limit))
+    resources = rows.all()
     
-    return result
+    _response_cache[cache_key] = resources
+    return resources
 
 @router.get("/resources/{resource_id}")
 async def get_fhir_resource(
     resource_id: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     current_user: UserSchema = Depends(get_current_practitioner)
 ):
     """Récupère une ressource FHIR spécifique"""
-    resource = db.query(FHIRResource).filter(FHIRResource.resource_id == resource_id).first()
+    cache_key = _response_cache_key(request, current_user)
+    content = _response_cache.get(cache_key)
+    if content is not None:
+        return Response(content=content, media_type="application/json")
+    
+    resource = await db.scalar(
+        select(FHIRResource).where(FHIRResource.resource_id == resource_id).limit(1)
+    )
     if not resource:
         raise HTTPException(status_code=404, detail="Ressource FHIR non trouvée")
     
-    return {
+    # Le JSON stocké est inséré tel quel, sans décodage ni re-sérialisation
+    envelope = orjson.dumps({
         "id": resource.id,
         "resource_type": resource.resource_type,
         "resource_id": resource.resource_id,
-        "fhir_data": json.loads(resource.fhir_data),
         "created_at": resource.created_at.isoformat(),
         "updated_at": resource.updated_at.isoformat()
-    }
+    }).decode()
+    content = f'{envelope[:-1]}, "fhir_data": {resource.fhir_data}}}'
+    
+    _response_cache[cache_key] = content
+    return Response(content=content, media_type="application/json")
 
 @router.post("/validate")
 async def validate_fhir_resource(
@@ -201,26 +323,20 @@ async def validate_fhir_resource(
     current_user: UserSchema = Depends(get_current_practitioner)
 ):
     """Valide une ressource FHIR (validation basique)"""
-    required_fields = {
-        "Claim": ["resourceType", "id", "status", "type", "patient", "provider"],
-        "Patient": ["resourceType", "id"],
-        "Practitioner": ["resourceType", "id"]
-    }
-    
     resource_type = fhir_data.get("resourceType")
     if not resource_type:
         raise HTTPException(status_code=400, detail="resourceType manquant")
     
-    if resource_type not in required_fields:
+    if resource_type not in FHIR_RESOURCE_MODELS:
         raise HTTPException(status_code=400, detail=f"Type de ressource non supporté: {resource_type}")
     
-    # Vérifier les champs requis
-    missing_fields = []
-    for field in required_fields[resource_type]:
-        if field not in fhir_data:
-            missing_fields.append(field)
-    
-    if missing_fields:
+    # Vérifier les champs requis (validation pydantic-core)
+    try:
+        FHIR_RESOURCE_MODELS[resource_type].model_validate(fhir_data)
+    except ValidationError as e:
+        missing_fields = sorted(
+            str(error["loc"][0]) for error in e.errors() if error["type"] == "missing"
+        )
         raise HTTPException(
             status_code=400,
             detail=f"Champs manquants pour {resource_type}: {missing_fields}"
@@ -234,20 +350,34 @@ async def validate_fhir_resource(
 
 @router.get("/stats")
 async def get_fhir_stats(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     current_user: UserSchema = Depends(get_current_practitioner)
 ):
     """Récupère des statistiques sur les ressources FHIR"""
-    total_resources = db.query(FHIRResource).count()
+    cache_key = _response_cache_key(request, current_user)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return cached
     
-    # Compter par type de ressource
-    resource_types = db.query(FHIRResource.resource_type).all()
-    type_counts = {}
-    for res_type in resource_types:
-        type_counts[res_type[0]] = type_counts.get(res_type[0], 0) + 1
+    # Total et dernière création en un seul agrégat
+    result = await db.execute(
+        select(func.count(FHIRResource.id), func.max(FHIRResource.created_at))
+    )
+    total_resources, last_created = result.one()
     
-    return {
+    # Compter par type de ressource directement en SQL
+    result = await db.execute(
+        select(FHIRResource.resource_type, func.count(FHIRResource.id))
+        .group_by(FHIRResource.resource_type)
+    )
+    type_counts = dict(result.all())
+    
+    stats = {
         "total_resources": total_resources,
         "resource_types": type_counts,
-        "last_created": db.query(FHIRResource).order_by(FHIRResource.created_at.desc()).first().created_at.isoformat() if total_resources > 0 else None
-    }
\ No newline at end of file
+        "last_created": last_created.isoformat() if last_created else None
+    }
+    
+    _response_cache[cache_key] = stats
+    return stats
\ No newline at end of file
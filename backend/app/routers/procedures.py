@@ -1,36 +1,127 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Form
+from sqlalchemy import select, exists, func, case, distinct, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload
 from typing import List, Optional
+from cachetools import TTLCache
+from datetime import datetime, timezone
+from pathlib import Path
+import aiofiles
+import asyncio
+import hashlib
 import json
+import logging
 import os
+import uuid
 
-from app.database import get_db, Procedure, Patient, Consent
+from app.database import get_db, SessionLocal, Procedure, Patient, Consent, User as UserModel
 from app.schemas.procedure import (
-    ProcedureCreate, ProcedureResponse, PatientCreate, ConsentCreate,
+    ProcedureCreate, ProcedureResponse, PatientCreate, Patient as PatientSchema, ConsentCreate,
     PROCEDURE_TYPES
 )
 from app.schemas.auth import User
 from app.utils.auth import get_current_practitioner
 from app.utils.blockchain import (
-    hash_patient_data, hash_consent_file, record_procedure_on_blockchain,
-    get_procedure_from_blockchain, get_patient_procedures_from_blockchain
+    hash_patient_data, record_procedure_on_blockchain, get_procedure_receipt,
+    get_procedure_from_blockchain, get_procedures_from_blockchain, get_patient_procedure_ids,
+    invalidate_procedure_cache, invalidate_procedure_ids_cache
 )
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Répertoire des consentements signés (créé une fois au démarrage de l'application)
+UPLOAD_DIR = Path("uploads/consents")
+
+# Taille des blocs lus lors de l'upload et du hachage des consentements (64 Kio)
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Les réponses des actes sont plates : aucune relation n'est chargée. En développement
+# (SQLALCHEMY_RAISELOAD=true), tout chargement paresseux lève une erreur pour repérer les N+1.
+if os.getenv("SQLALCHEMY_RAISELOAD", "false").lower() == "true":
+    PROCEDURE_LOAD_OPTIONS = (raiseload("*"),)
+else:
+    PROCEDURE_LOAD_OPTIONS = ()
+
+# Nombre de patients distincts (COUNT DISTINCT coûteux) rafraîchi toutes les 5 minutes
+UNIQUE_PATIENTS_TTL_SECONDS = 300
+_unique_patients_cache = TTLCache(maxsize=1, ttl=UNIQUE_PATIENTS_TTL_SECONDS)
+
+# Nombre maximal de valeurs par clause IN
+IN_CLAUSE_BATCH_SIZE = 1000
+
+# Attente de la confirmation d'une transaction : un reçu est demandé toutes les
+# 2 secondes, sans bloquer de thread entre deux lectures
+RECEIPT_TIMEOUT_SECONDS = 120
+RECEIPT_POLL_INTERVAL_SECONDS = 2
+
+async def get_local_procedures_by_blockchain_id(db: AsyncSession, blockchain_ids: list) -> dict:
+    """Lit la copie locale d'actes enregistrés sur la blockchain (une requête IN par lot)"""
+    procedures_table = Procedure.__table__
+    procedures = {}
+    for start in range(0, len(blockchain_ids), IN_CLAUSE_BATCH_SIZE):
+        batch = blockchain_ids[start:start + IN_CLAUSE_BATCH_SIZE]
+        rows = await db.execute(
+            select(procedures_table, UserModel.wallet_address)
+            .join(UserModel, UserModel.id == procedures_table.c.practitioner_id)
+            .where(procedures_table.c.blockchain_id.in_(batch))
+        )
+        for row in rows:
+            # Même format que format_procedure pour les actes lus sur la blockchain.
+            # created_at est un datetime naïf en UTC ; is_active n'est connu que de la
+            # chaîne (deleteProcedure), la copie locale le laisse indéterminé.
+            procedures[row.blockchain_id] = {
+                "id": row.blockchain_id,
+                "patient_id": row.patient_hash,
+                "practitioner": row.wallet_address,
+                "procedure_type": row.procedure_type,
+                "duration": row.duration,
+                "timestamp": int(row.created_at.replace(tzinfo=timezone.utc).timestamp()),
+                "consent_hash": row.consent_hash,
+                "is_active": None,
+                "metadata": row.metadata
+            }
+    return procedures
+
+async def confirm_procedure_on_blockchain(procedure_id: int, tx_hash: str):
+    """Attend la confirmation de la transaction puis marque l'acte comme enregistré (tâche de fond)"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + RECEIPT_TIMEOUT_SECONDS
+    receipt = await asyncio.to_thread(get_procedure_receipt, tx_hash)
+    while receipt is None and loop.time() < deadline:
+        await asyncio.sleep(RECEIPT_POLL_INTERVAL_SECONDS)
+        receipt = await asyncio.to_thread(get_procedure_receipt, tx_hash)
+    
+    if receipt is None:
+        logger.error("Erreur blockchain: transaction %s non confirmée après %s s", tx_hash, RECEIPT_TIMEOUT_SECONDS)
+        return
+    if not receipt["success"]:
+        logger.error("Erreur blockchain: transaction %s non confirmée: %s", tx_hash, receipt.get("error"))
+        return
+    
+    async with SessionLocal() as db:
+        db_procedure = await db.get(Procedure, procedure_id)
+        if db_procedure:
+            db_procedure.blockchain_id = db_procedure.id  # ID local comme ID blockchain
+            await db.commit()
+            
+            # L'acte est désormais lisible sur la chaîne : oublier les lectures antérieures
+            invalidate_procedure_cache(db_procedure.blockchain_id)
+            invalidate_procedure_ids_cache(db_procedure.patient_hash)
 
 @router.post("/patients", response_model=PatientCreate)
 async def create_patient(
     patient: PatientCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
     """Crée un nouveau patient (pseudonymisé)"""
     # Vérifier si le patient existe déjà
-    existing_patient = db.query(Patient).filter(
-        Patient.patient_hash == patient.patient_hash
-    ).first()
+    patient_exists = await db.scalar(
+        select(exists().where(Patient.patient_hash == patient.patient_hash))
+    )
     
-    if existing_patient:
+    if patient_exists:
         raise HTTPException(
             status_code=400,
             detail="Patient déjà enregistré"
@@ -38,30 +129,35 @@ async def create_patient(
     
     db_patient = Patient(**patient.dict())
     db.add(db_patient)
-    db.commit()
-    db.refresh(db_patient)
+    await db.commit()
+    await db.refresh(db_patient)
     
     return db_patient
 
-@router.get("/patients", response_model=List[PatientCreate])
+@router.get("/patients", response_model=List[PatientSchema])
 async def get_patients(
-    skip: int = 0,
+    after_id: Optional[int] = None,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
-    """Récupère la liste des patients"""
-    patients = db.query(Patient).offset(skip).limit(limit).all()
-    return patients
+    """Récupère la liste des patients (pagination par curseur sur l'ID)"""
+    query = select(Patient)
+    
+    if after_id is not None:
+        query = query.where(Patient.id > after_id)
+    
+    patients = await db.scalars(query.order_by(Patient.id).limit(limit))
+    return patients.all()
 
 @router.get("/patients/{patient_hash}", response_model=PatientCreate)
 async def get_patient(
     patient_hash: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
     """Récupère un patient par son hash"""
-    patient = db.query(Patient).filter(Patient.patient_hash == patient_hash).first()
+    patient = await db.scalar(select(Patient).where(Patient.patient_hash == patient_hash))
     if patient is None:
         raise HTTPException(status_code=404, detail="Patient non trouvé")
     return patient
@@ -69,23 +165,17 @@ async def get_patient(
 @router.post("/", response_model=ProcedureResponse)
 async def create_procedure(
     procedure: ProcedureCreate,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
     """Crée un nouvel acte médical"""
-    # Vérifier que le type d'intervention est valide
-    if procedure.procedure_type not in PROCEDURE_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Type d'intervention invalide. Types supportés: {PROCEDURE_TYPES}"
-        )
-    
     # Vérifier que le patient existe
-    patient = db.query(Patient).filter(
-        Patient.patient_hash == procedure.patient_hash
-    ).first()
+    patient_exists = await db.scalar(
+        select(exists().where(Patient.patient_hash == procedure.patient_hash))
+    )
     
-    if not patient:
+    if not patient_exists:
         raise HTTPException(
             status_code=404,
             detail="Patient non trouvé"
@@ -102,15 +192,17 @@ async def create_procedure(
     )
     
     db.add(db_procedure)
-    db.commit()
-    db.refresh(db_procedure)
+    await db.commit()
+    await db.refresh(db_procedure)
     
     # Enregistrer sur la blockchain (si configuré)
     try:
         # Note: En production, la clé privée devrait être sécurisée
         private_key = os.getenv("PRACTITIONER_PRIVATE_KEY")
         if private_key:
-            blockchain_result = record_procedure_on_blockchain(
+            # Envoi dans un thread : les appels RPC ne bloquent pas la boucle d'événements
+            blockchain_result = await asyncio.to_thread(
+                record_procedure_on_blockchain,
                 patient_hash=procedure.patient_hash,
                 procedure_type=procedure.procedure_type,
                 duration=procedure.duration,
@@ -120,45 +212,54 @@ async def create_procedure(
             )
             
             if blockchain_result["success"]:
-                db_procedure.blockchain_id = db_procedure.id  # ID local comme ID blockchain
                 db_procedure.blockchain_tx_hash = blockchain_result["tx_hash"]
-                db.commit()
-                db.refresh(db_procedure)
+                await db.commit()
+                await db.refresh(db_procedure)
+                
+                # La confirmation est attendue après l'envoi de la réponse
+                background_tasks.add_task(
+                    confirm_procedure_on_blockchain,
+                    db_procedure.id,
+                    blockchain_result["tx_hash"]
+                )
     except Exception as e:
-        print(f"Erreur blockchain: {e}")
+        logger.error("Erreur blockchain: %s", e)
         # L'acte est quand même créé en local
     
     return db_procedure
 
 @router.get("/", response_model=List[ProcedureResponse])
 async def get_procedures(
-    skip: int = 0,
+    after_id: Optional[int] = None,
     limit: int = 100,
     patient_hash: Optional[str] = None,
     practitioner_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
-    """Récupère la liste des actes avec filtres optionnels"""
-    query = db.query(Procedure)
+    """Récupère la liste des actes avec filtres optionnels (pagination par curseur sur l'ID)"""
+    query = select(Procedure).options(*PROCEDURE_LOAD_OPTIONS)
     
     if patient_hash:
-        query = query.filter(Procedure.patient_hash == patient_hash)
+        query = query.where(Procedure.patient_hash == patient_hash)
     
     if practitioner_id:
-        query = query.filter(Procedure.practitioner_id == practitioner_id)
+        query = query.where(Procedure.practitioner_id == practitioner_id)
     
-    procedures = query.offset(skip).limit(limit).all()
-    return procedures
+    if after_id is not None:
+        query = query.where(Procedure.id > after_id)
+    
+    procedures = await db.scalars(query.order_by(Procedure.id).limit(limit))
+    return procedures.all()
 
 @router.get("/{procedure_id}", response_model=ProcedureResponse)
 async def get_procedure(
     procedure_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
     """Récupère un acte par son ID"""
-    procedure = db.query(Procedure).filter(Procedure.id == procedure_id).first()
+    procedure = await db.get(Procedure, procedure_id, options=PROCEDURE_LOAD_OPTIONS)
     if procedure is None:
         raise HTTPException(status_code=404, detail="Acte non trouvé")
     return procedure
@@ -166,15 +267,29 @@ async def get_procedure(
 @router.get("/patient/{patient_hash}/history", response_model=List[ProcedureResponse])
 async def get_patient_history(
     patient_hash: str,
-    db: Session = Depends(get_db),
+    after_created_at: Optional[datetime] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
-    """Récupère l'historique complet d'un patient"""
-    procedures = db.query(Procedure).filter(
-        Procedure.patient_hash == patient_hash
-    ).order_by(Procedure.created_at.desc()).all()
+    """Récupère l'historique d'un patient, du plus récent au plus ancien (curseur sur date + ID)"""
+    # Requête Core sur la table : des lignes sont renvoyées sans hydrater d'objets ORM
+    procedures_table = Procedure.__table__
+    query = select(procedures_table).where(procedures_table.c.patient_hash == patient_hash)
     
-    return procedures
+    # Reprendre après le dernier acte de la page précédente
+    if after_created_at is not None and after_id is not None:
+        query = query.where(
+            tuple_(procedures_table.c.created_at, procedures_table.c.id) < (after_created_at, after_id)
+        )
+    
+    query = query.order_by(procedures_table.c.created_at.desc(), procedures_table.c.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    
+    result = await db.execute(query)
+    return result.all()
 
 @router.get("/blockchain/{procedure_id}")
 async def get_procedure_from_blockchain_endpoint(
@@ -182,7 +297,7 @@ async def get_procedure_from_blockchain_endpoint(
     current_user: User = Depends(get_current_practitioner)
 ):
     """Récupère un acte directement depuis la blockchain"""
-    procedure = get_procedure_from_blockchain(procedure_id)
+    procedure = await asyncio.to_thread(get_procedure_from_blockchain, procedure_id)
     if procedure is None:
         raise HTTPException(status_code=404, detail="Acte non trouvé sur la blockchain")
     return procedure
@@ -190,22 +305,32 @@ async def get_procedure_from_blockchain_endpoint(
 @router.get("/blockchain/patient/{patient_hash}")
 async def get_patient_procedures_from_blockchain_endpoint(
     patient_hash: str,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
     """Récupère tous les actes d'un patient depuis la blockchain"""
-    procedures = get_patient_procedures_from_blockchain(patient_hash)
-    return {"procedures": procedures}
+    procedure_ids = await asyncio.to_thread(get_patient_procedure_ids, patient_hash)
+    chain_procedures = await asyncio.to_thread(get_procedures_from_blockchain, procedure_ids)
+    procedures = {procedure["id"]: procedure for procedure in chain_procedures}
+    
+    # Actes illisibles sur la blockchain : repli sur la copie locale
+    missing_ids = [proc_id for proc_id in procedure_ids if proc_id not in procedures]
+    if missing_ids:
+        procedures.update(await get_local_procedures_by_blockchain_id(db, missing_ids))
+    
+    # Conserver l'ordre renvoyé par le contrat
+    return {"procedures": [procedures[proc_id] for proc_id in procedure_ids if proc_id in procedures]}
 
 @router.post("/upload-consent")
 async def upload_consent(
     procedure_id: int = Form(...),
     consent_file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
     """Upload un fichier de consentement"""
     # Vérifier que l'acte existe
-    procedure = db.query(Procedure).filter(Procedure.id == procedure_id).first()
+    procedure = await db.get(Procedure, procedure_id)
     if not procedure:
         raise HTTPException(status_code=404, detail="Acte non trouvé")
     
@@ -216,19 +341,22 @@ async def upload_consent(
             detail="Vous n'êtes pas autorisé à modifier cet acte"
         )
     
-    # Lire le contenu du fichier
-    content = await consent_file.read()
-    
-    # Générer le hash du fichier
-    consent_hash = hash_consent_file(content)
-    
-    # Sauvegarder le fichier
-    upload_dir = "uploads/consents"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_path = os.path.join(upload_dir, f"consent_{procedure_id}_{consent_hash[:8]}.pdf")
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # Écrire le fichier par blocs dans un fichier temporaire en calculant son hash au passage
+    part_path = UPLOAD_DIR / f"consent_{procedure_id}_{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    try:
+        async with aiofiles.open(part_path, "wb") as f:
+            while chunk := await consent_file.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+                await f.write(chunk)
+        consent_hash = digest.hexdigest()
+        
+        # Renommer le fichier une fois le hash connu
+        file_path = str(UPLOAD_DIR / f"consent_{procedure_id}_{consent_hash[:8]}.pdf")
+        os.replace(part_path, file_path)
+    finally:
+        # Ne pas laisser de fichier partiel en cas d'échec ou de déconnexion du client
+        part_path.unlink(missing_ok=True)
     
     # Créer l'enregistrement de consentement
     consent = Consent(
@@ -238,12 +366,10 @@ async def upload_consent(
     )
     
     db.add(consent)
-    db.commit()
-    db.refresh(consent)
     
-    # Mettre à jour le hash de consentement de l'acte
+    # Mettre à jour le hash de consentement de l'acte (même transaction)
     procedure.consent_hash = consent_hash
-    db.commit()
+    await db.commit()
     
     return {
         "message": "Consentement uploadé avec succès",
@@ -261,24 +387,35 @@ async def get_procedure_types():
 
 @router.get("/stats/summary")
 async def get_procedure_stats(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_practitioner)
 ):
     """Récupère des statistiques sur les actes"""
-    total_procedures = db.query(Procedure).count()
-    user_procedures = db.query(Procedure).filter(
-        Procedure.practitioner_id == current_user.id
-    ).count()
+    # Compteurs globaux en un seul agrégat
+    counts = await db.execute(
+        select(
+            func.count(Procedure.id),
+            func.count(case((Procedure.practitioner_id == current_user.id, 1)))
+        )
+    )
+    total_procedures, user_procedures = counts.one()
+    
+    # Le comptage distinct n'est recalculé qu'à l'expiration du cache
+    unique_patients = _unique_patients_cache.get("unique_patients")
+    if unique_patients is None:
+        unique_patients = await db.scalar(select(func.count(distinct(Procedure.patient_hash))))
+        _unique_patients_cache["unique_patients"] = unique_patients
     
     # Statistiques par type d'intervention
-    procedure_types = db.query(Procedure.procedure_type).all()
-    type_counts = {}
-    for proc_type in procedure_types:
-        type_counts[proc_type[0]] = type_counts.get(proc_type[0], 0) + 1
+    type_rows = await db.execute(
+        select(Procedure.procedure_type, func.count(Procedure.id))
+        .group_by(Procedure.procedure_type)
+    )
+    type_counts = dict(type_rows.all())
     
     return {
         "total_procedures": total_procedures,
         "user_procedures": user_procedures,
         "procedure_types": type_counts,
-        "unique_patients": db.query(Procedure.patient_hash).distinct().count()
+        "unique_patients": unique_patients
     }
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -27,6 +27,10 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UserPage(BaseModel):
+    items: List[User]
+    next_cursor: Optional[int] = None
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -37,4 +41,6 @@ class Token(BaseModel):
     user: User
 
 class TokenData(BaseModel):
-    username: Optional[str] = None
\ No newline at end of file
+    username: Optional[str] = None
+    user_id: Optional[int] = None
+    exp: Optional[int] = None
\ No newline at end of file
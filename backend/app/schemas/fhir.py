@@ -0,0 +1,40 @@
+from pydantic import BaseModel, Json
+from typing import Any, Literal, Optional
+from datetime import datetime
+
+class FHIRResourceBase(BaseModel):
+    id: Any
+
+    class Config:
+        extra = "allow"
+
+class ClaimResource(FHIRResourceBase):
+    resourceType: Literal["Claim"]
+    status: Any
+    type: Any
+    patient: Any
+    provider: Any
+
+class PatientResource(FHIRResourceBase):
+    resourceType: Literal["Patient"]
+
+class PractitionerResource(FHIRResourceBase):
+    resourceType: Literal["Practitioner"]
+
+class FHIRResourceOut(BaseModel):
+    id: int
+    resource_type: str
+    resource_id: str
+    fhir_data: Optional[Json[Any]] = None  # JSON stocké, décodé par pydantic-core
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+# Modèles de validation par type de ressource FHIR
+FHIR_RESOURCE_MODELS = {
+    "Claim": ClaimResource,
+    "Patient": PatientResource,
+    "Practitioner": PractitionerResource
+}
@@ -1,7 +1,23 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Literal, get_args
 from datetime import datetime
 
+# Types d'interventions supportés (validés par pydantic-core avant l'appel de la route)
+ProcedureType = Literal[
+    "embolisation",
+    "ponction",
+    "stent",
+    "angioplastie",
+    "biopsie",
+    "drainage",
+    "ablation",
+    "radiofréquence",
+    "cryothérapie",
+    "chimioembolisation"
+]
+
+PROCEDURE_TYPES = list(get_args(ProcedureType))
+
 class PatientBase(BaseModel):
     patient_hash: str
     first_name_hash: Optional[str] = None
@@ -20,7 +36,7 @@ class Patient(PatientBase):
 
 class ProcedureBase(BaseModel):
     patient_hash: str
-    procedure_type: str = Field(..., description="Type d'intervention (embolisation, ponction, stent, etc.)")
+    procedure_type: ProcedureType = Field(..., description="Type d'intervention (embolisation, ponction, stent, etc.)")
     duration: int = Field(..., gt=0, description="Durée en minutes")
     consent_hash: str
     metadata: Optional[str] = None  # JSON FHIR
@@ -29,7 +45,7 @@ class ProcedureCreate(ProcedureBase):
     pass
 
 class ProcedureUpdate(BaseModel):
-    procedure_type: Optional[str] = None
+    procedure_type: Optional[ProcedureType] = None
     duration: Optional[int] = None
     consent_hash: Optional[str] = None
     metadata: Optional[str] = None
@@ -77,17 +93,3 @@ class Consent(ConsentBase):
 
     class Config:
         from_attributes = True
-
-# Types d'interventions supportés
-PROCEDURE_TYPES = [
-    "embolisation",
-    "ponction",
-    "stent",
-    "angioplastie",
-    "biopsie",
-    "drainage",
-    "ablation",
-    "radiofréquence",
-    "cryothérapie",
-    "chimioembolisation"
-]
\ No newline at end of file
@@ -1,10 +1,17 @@
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+from cachetools import TTLCache
+import asyncio
+import hashlib
+import time
+import jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
 from app.database import get_db, User
 from app.schemas.auth import TokenData
@@ -14,18 +21,55 @@ SECRET_KEY = "your-secret-key-change-in-production"  # À changer en production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Configuration du hachage des mots de passe
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Configuration du hachage des mots de passe (argon2id, bcrypt conservé pour les anciens hash)
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1
+)
 
 # Configuration de la sécurité
 security = HTTPBearer()
 
+# Cache token -> utilisateur pour éviter un décodage et un SELECT par requête. On y garde
+# une copie figée des colonnes, jamais l'objet ORM lié à la session d'une autre requête.
+USER_CACHE_TTL_SECONDS = 60
+_user_cache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL_SECONDS)
+_USER_COLUMNS = tuple(attr.key for attr in inspect(User).column_attrs)
+
+def _token_cache_key(token: str) -> bytes:
+    """Clé de cache dérivée du token (le token brut n'est pas conservé)"""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def _user_snapshot(user: User) -> Mapping:
+    """Copie immuable des colonnes d'un utilisateur"""
+    return MappingProxyType({key: getattr(user, key) for key in _USER_COLUMNS})
+
+async def _user_from_snapshot(db: AsyncSession, snapshot: Mapping) -> User:
+    """Rattache un utilisateur en cache à la session de la requête, sans SELECT"""
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return await db.merge(user, load=False)
+
+def invalidate_user_cache(user_id: int) -> None:
+    """Retire un utilisateur du cache des tokens"""
+    for key, (snapshot, _) in list(_user_cache.items()):
+        if snapshot["id"] == user_id:
+            _user_cache.pop(key, None)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Vérifie un mot de passe"""
+    """Vérifie un mot de passe (bloquant et coûteux : connexion uniquement, via asyncio.to_thread)"""
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Vérifie un mot de passe et retourne un nouveau hash si le schéma ou les paramètres ont changé"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password: str) -> str:
-    """Génère un hash du mot de passe"""
+    """Génère un hash du mot de passe (bloquant : à appeler via asyncio.to_thread)"""
     return pwd_context.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -46,23 +90,31 @@ def verify_token(token: str) -> Optional[TokenData]:
         username: str = payload.get("sub")
         if username is None:
             return None
-        token_data = TokenData(username=username)
+        token_data = TokenData(username=username, user_id=payload.get("uid"), exp=payload.get("exp"))
         return token_data
-    except JWTError:
+    except jwt.InvalidTokenError:
         return None
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
     """Authentifie un utilisateur"""
-    user = db.query(User).filter(User.username == username).first()
+    user = await get_user_by_username(db, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    # Le hachage est coûteux en CPU : exécuté dans un thread pour ne pas bloquer la boucle
+    valid, new_hash = await asyncio.to_thread(
+        verify_and_update_password, password, user.hashed_password
+    )
+    if not valid:
         return None
+    if new_hash:
+        # Migration transparente des anciens hash bcrypt vers argon2id
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
-def get_current_user(
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> User:
     """Récupère l'utilisateur actuel depuis le token JWT"""
     credentials_exception = HTTPException(
@@ -71,18 +123,31 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    token = credentials.credentials
+    cache_key = _token_cache_key(token)
+    cached = _user_cache.get(cache_key)
+    if cached is not None:
+        snapshot, expires_at = cached
+        if expires_at is None or expires_at > time.time():
+            return await _user_from_snapshot(db, snapshot)
+        _user_cache.pop(cache_key, None)
+    
     try:
-        token = credentials.credentials
         token_data = verify_token(token)
         if token_data is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.InvalidTokenError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
+    # Les tokens récents portent l'ID : recherche par clé primaire (identity map de la session)
+    if token_data.user_id is not None:
+        user = await db.get(User, token_data.user_id)
+    else:
+        user = await get_user_by_username(db, token_data.username)
+    if user is None or user.username != token_data.username:
         raise credentials_exception
     
+    _user_cache[cache_key] = (_user_snapshot(user), token_data.exp)
     return user
 
 def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
@@ -109,8 +174,8 @@ def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
         )
     return current_user
 
-def create_user(
-    db: Session,
+async def create_user(
+    db: AsyncSession,
     username: str,
     email: str,
     password: str,
@@ -118,7 +183,8 @@ def create_user(
     wallet_address: str = ""
 ) -> User:
     """Crée un nouvel utilisateur"""
-    hashed_password = get_password_hash(password)
+    # Le hachage est coûteux en CPU : exécuté dans un thread pour ne pas bloquer la boucle
+    hashed_password = await asyncio.to_thread(get_password_hash, password)
     db_user = User(
         username=username,
         email=email,
@@ -127,29 +193,29 @@ def create_user(
         wallet_address=wallet_address
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def get_user_by_username(db: Session, username: str) -> Optional[User]:
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
     """Récupère un utilisateur par son nom d'utilisateur"""
-    return db.query(User).filter(User.username == username).first()
+    return await db.scalar(select(User).where(User.username == username))
 
-def get_user_by_email(db: Session, email: str) -> Optional[User]:
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
     """Récupère un utilisateur par son email"""
-    return db.query(User).filter(User.email == email).first()
+    return await db.scalar(select(User).where(User.email == email))
 
-def get_user_by_wallet(db: Session, wallet_address: str) -> Optional[User]:
+async def get_user_by_wallet(db: AsyncSession, wallet_address: str) -> Optional[User]:
     """Récupère un utilisateur par son adresse wallet"""
-    return db.query(User).filter(User.wallet_address == wallet_address).first()
+    return await db.scalar(select(User).where(User.wallet_address == wallet_address))
 
-def update_user(
-    db: Session,
+async def update_user(
+    db: AsyncSession,
     user_id: int,
     **kwargs
 ) -> Optional[User]:
     """Met à jour un utilisateur"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         return None
     
@@ -158,16 +224,18 @@ def update_user(
             setattr(user, key, value)
     
     user.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    invalidate_user_cache(user_id)
     return user
 
-def delete_user(db: Session, user_id: int) -> bool:
+async def delete_user(db: AsyncSession, user_id: int) -> bool:
     """Supprime un utilisateur"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         return False
     
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await db.commit()
+    invalidate_user_cache(user_id)
     return True
\ No newline at end of file
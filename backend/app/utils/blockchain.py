@@ -1,18 +1,143 @@
 from web3 import Web3
+from cachetools import TTLCache
 from web3.middleware import geth_poa_middleware
-import json
+from web3.exceptions import TransactionNotFound
+from eth_utils import collapse_if_tuple, function_abi_to_4byte_selector
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import orjson
 import os
+import threading
 from typing import Optional, Dict, Any
 import hashlib
 
+# Contrat Multicall3 (déployé à la même adresse sur la plupart des réseaux EVM)
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
 # Configuration Web3
 web3 = None
 contract = None
 contract_address = None
+chain_id = None
+sender_address = None
+multicall = None
+
+# Encodage précalculé de getProcedure (appel brut eth_call sans parcourir l'ABI)
+_get_procedure_selector = None
+_get_procedure_input_types = None
+_get_procedure_output_types = None
+
+# Lecture du nonce et envoi sérialisés dans le processus : deux transactions lancées
+# en même temps ne doivent pas lire le même nonce "pending"
+_send_lock = threading.Lock()
+
+# Caches des lectures : courts, car updateConsent et deleteProcedure modifient un acte
+# directement sur la chaîne, sans passer par cette API
+PROCEDURE_CACHE_TTL_SECONDS = 30
+PROCEDURE_IDS_CACHE_TTL_SECONDS = 30
+_procedure_cache = TTLCache(maxsize=10_000, ttl=PROCEDURE_CACHE_TTL_SECONDS)
+_procedure_ids_cache = TTLCache(maxsize=10_000, ttl=PROCEDURE_IDS_CACHE_TTL_SECONDS)
+_cache_lock = threading.Lock()
+
+# Pool de threads pour paralléliser les appels RPC indépendants
+_rpc_executor = ThreadPoolExecutor(max_workers=4)
+
+# Artefact compilé du contrat (chemin calculé une seule fois)
+ABI_PATH = os.path.join(os.path.dirname(__file__), "../../../contracts/artifacts/contracts/MedicalProcedure.sol/MedicalProcedure.json")
+
+# ABI de fallback si le fichier n'existe pas
+FALLBACK_ABI = [
+    {
+        "inputs": [],
+        "stateMutability": "nonpayable",
+        "type": "constructor"
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "uint256",
+                "name": "procedureId",
+                "type": "uint256"
+            },
+            {
+                "indexed": True,
+                "internalType": "bytes32",
+                "name": "patientId",
+                "type": "bytes32"
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "practitioner",
+                "type": "address"
+            },
+            {
+                "indexed": False,
+                "internalType": "string",
+                "name": "procedureType",
+                "type": "string"
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "timestamp",
+                "type": "uint256"
+            }
+        ],
+        "name": "ProcedureRecorded",
+        "type": "event"
+    }
+]
+
+@functools.lru_cache(maxsize=None)
+def _load_abi(abi_path: str) -> list:
+    """Charge l'ABI depuis l'artefact compilé (une seule lecture disque par processus)"""
+    try:
+        with open(abi_path, 'rb') as f:
+            return orjson.loads(f.read())['abi']
+    except FileNotFoundError:
+        return FALLBACK_ABI
 
 def init_web3():
     """Initialise la connexion Web3 et le contrat"""
-    global web3, contract, contract_address
+    global web3, contract, contract_address, chain_id, sender_address, multicall
+    global _get_procedure_selector, _get_procedure_input_types, _get_procedure_output_types
+    
+    # Déjà initialisé dans ce processus
+    if contract is not None:
+        return
     
     # Configuration réseau
     network_url = os.getenv("BLOCKCHAIN_URL", "http://127.0.0.1:8545")
@@ -31,62 +156,32 @@ def init_web3():
     if not web3.is_connected():
         raise ConnectionError("Impossible de se connecter au réseau blockchain")
     
-    # Charger l'ABI du contrat
-    abi_path = os.path.join(os.path.dirname(__file__), "../../../contracts/artifacts/contracts/MedicalProcedure.sol/MedicalProcedure.json")
+    # Charger l'ABI du contrat (mis en cache après la première lecture)
+    abi = _load_abi(ABI_PATH)
     
-    try:
-        with open(abi_path, 'r') as f:
-            contract_json = json.load(f)
-            abi = contract_json['abi']
-    except FileNotFoundError:
-        # ABI de fallback si le fichier n'existe pas
-        abi = [
-            {
-                "inputs": [],
-                "stateMutability": "nonpayable",
-                "type": "constructor"
-            },
-            {
-                "anonymous": False,
-                "inputs": [
-                    {
-                        "indexed": True,
-                        "internalType": "uint256",
-                        "name": "procedureId",
-                        "type": "uint256"
-                    },
-                    {
-                        "indexed": True,
-                        "internalType": "bytes32",
-                        "name": "patientId",
-                        "type": "bytes32"
-                    },
-                    {
-                        "indexed": True,
-                        "internalType": "address",
-                        "name": "practitioner",
-                        "type": "address"
-                    },
-                    {
-                        "indexed": False,
-                        "internalType": "string",
-                        "name": "procedureType",
-                        "type": "string"
-                    },
-                    {
-                        "indexed": False,
-                        "internalType": "uint256",
-                        "name": "timestamp",
-                        "type": "uint256"
-                    }
-                ],
-                "name": "ProcedureRecorded",
-                "type": "event"
-            }
-        ]
+    # Créer l'instance du contrat (publiée en dernier, voir plus bas)
+    new_contract = web3.eth.contract(address=contract_address, abi=abi)
+    
+    # Instance Multicall3 réutilisée pour les lectures groupées
+    multicall = web3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
     
-    # Créer l'instance du contrat
-    contract = web3.eth.contract(address=contract_address, abi=abi)
+    # Sélecteur et types de getProcedure (absents de l'ABI de fallback)
+    get_procedure_abi = next(
+        (item for item in abi if item.get("type") == "function" and item.get("name") == "getProcedure"),
+        None
+    )
+    if get_procedure_abi is not None:
+        _get_procedure_selector = function_abi_to_4byte_selector(get_procedure_abi)
+        _get_procedure_input_types = [collapse_if_tuple(arg) for arg in get_procedure_abi["inputs"]]
+        _get_procedure_output_types = [collapse_if_tuple(arg) for arg in get_procedure_abi["outputs"]]
+    
+    # Valeurs constantes pour la durée de vie du processus
+    chain_id = web3.eth.chain_id
+    sender_address = web3.eth.accounts[0]
+    
+    # Le contrat sert de marqueur d'initialisation : il n'est publié qu'une fois
+    # tout le reste prêt, sinon un appel concurrent verrait chain_id ou sender_address à None
+    contract = new_contract
     
     print(f"✅ Web3 initialisé - Réseau: {network_url}")
     print(f"📋 Contrat déployé à: {contract_address}")
@@ -103,13 +198,37 @@ def get_contract():
         init_web3()
     return contract
 
+@functools.lru_cache(maxsize=8192)
 def hash_patient_data(patient_id: str) -> str:
     """Génère un hash du patient pour la pseudonymisation"""
     return hashlib.sha256(patient_id.encode()).hexdigest()
 
-def hash_consent_file(file_content: bytes) -> str:
-    """Génère un hash du fichier de consentement"""
-    return hashlib.sha256(file_content).hexdigest()
+def _cache_procedure(procedure: Dict[str, Any]) -> Dict[str, Any]:
+    """Mémorise un acte lu sur la blockchain"""
+    with _cache_lock:
+        _procedure_cache[procedure["id"]] = procedure
+    return procedure
+
+def _get_procedure_ids(kind: str, owner: str, fetch) -> list:
+    """Retourne la liste d'IDs d'actes d'un patient ou d'un praticien (cache court)"""
+    with _cache_lock:
+        procedure_ids = _procedure_ids_cache.get((kind, owner))
+    if procedure_ids is None:
+        procedure_ids = fetch(owner).call()
+        with _cache_lock:
+            _procedure_ids_cache[(kind, owner)] = procedure_ids
+    return procedure_ids
+
+def invalidate_procedure_ids_cache(patient_hash: str, practitioner_address: Optional[str] = None):
+    """Oublie les listes d'IDs modifiées par un nouvel acte (par défaut, celles de l'émetteur)"""
+    with _cache_lock:
+        _procedure_ids_cache.pop(("patient", patient_hash), None)
+        _procedure_ids_cache.pop(("practitioner", practitioner_address or sender_address), None)
+
+def invalidate_procedure_cache(procedure_id: int):
+    """Oublie un acte dont l'état a changé sur la blockchain"""
+    with _cache_lock:
+        _procedure_cache.pop(procedure_id, None)
 
 def record_procedure_on_blockchain(
     patient_hash: str,
@@ -119,7 +238,7 @@ def record_procedure_on_blockchain(
     metadata: str,
     private_key: str
 ) -> Dict[str, Any]:
-    """Enregistre un acte sur la blockchain"""
+    """Envoie la transaction d'enregistrement d'un acte sans attendre sa confirmation"""
     if contract is None:
         init_web3()
     
@@ -133,96 +252,169 @@ def record_procedure_on_blockchain(
             metadata
         )
         
-        # Estimer le gas
-        gas_estimate = function.estimate_gas({'from': web3.eth.accounts[0]})
+        # Estimer le gas et lire le prix du gas en parallèle
+        gas_future = _rpc_executor.submit(function.estimate_gas, {'from': sender_address})
+        gas_price_future = _rpc_executor.submit(lambda: web3.eth.gas_price)
         
-        # Construire la transaction
-        transaction = function.build_transaction({
-            'from': web3.eth.accounts[0],
-            'gas': gas_estimate,
-            'gasPrice': web3.eth.gas_price,
-            'nonce': web3.eth.get_transaction_count(web3.eth.accounts[0])
-        })
+        gas = gas_future.result()
+        gas_price = gas_price_future.result()
         
-        # Signer et envoyer la transaction
-        signed_txn = web3.eth.account.sign_transaction(transaction, private_key)
-        tx_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
+        # Le nonce est relu sur le nœud à chaque transaction : un compteur local ne
+        # serait pas partagé entre les workers (WEB_CONCURRENCY) et produirait des doublons
+        with _send_lock:
+            # Construire la transaction
+            transaction = function.build_transaction({
+                'from': sender_address,
+                'chainId': chain_id,
+                'gas': gas,
+                'gasPrice': gas_price,
+                'nonce': web3.eth.get_transaction_count(sender_address, "pending")
+            })
+            
+            # Signer et envoyer la transaction (la confirmation est suivie à part)
+            signed_txn = web3.eth.account.sign_transaction(transaction, private_key)
+            tx_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
         
-        # Attendre la confirmation
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+        # Les listes d'actes du patient et du praticien vont changer
+        invalidate_procedure_ids_cache(patient_hash, sender_address)
         
         return {
             "success": True,
-            "tx_hash": tx_hash.hex(),
+            "tx_hash": tx_hash.hex()
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+def get_procedure_receipt(tx_hash: str) -> Optional[Dict[str, Any]]:
+    """Lit le reçu d'une transaction d'enregistrement d'acte (None tant qu'elle n'est pas minée)"""
+    if contract is None:
+        init_web3()
+    
+    try:
+        tx_receipt = web3.eth.get_transaction_receipt(tx_hash)
+        
+        return {
+            "success": tx_receipt.status == 1,
+            "tx_hash": tx_hash,
             "block_number": tx_receipt.blockNumber,
             "gas_used": tx_receipt.gasUsed
         }
         
+    except TransactionNotFound:
+        return None
+        
     except Exception as e:
         return {
             "success": False,
+            "tx_hash": tx_hash,
             "error": str(e)
         }
 
+def _encode_get_procedure(procedure_id: int) -> bytes:
+    """Encode l'appel getProcedure(procedure_id) à partir du sélecteur précalculé"""
+    return _get_procedure_selector + web3.codec.encode(_get_procedure_input_types, [procedure_id])
+
+def _decode_procedure(return_data: bytes) -> tuple:
+    """Décode la structure Procedure retournée par getProcedure"""
+    return web3.codec.decode(_get_procedure_output_types, return_data)[0]
+
+def format_procedure(procedure: tuple) -> Dict[str, Any]:
+    """Convertit la structure Procedure retournée par le contrat en dictionnaire"""
+    return {
+        "id": procedure[0],
+        "patient_id": procedure[1],
+        # Adresse au format checksum, comme avec contract.functions.getProcedure().call()
+        "practitioner": Web3.to_checksum_address(procedure[2]),
+        "procedure_type": procedure[3],
+        "duration": procedure[4],
+        "timestamp": procedure[5],
+        "consent_hash": procedure[6],
+        "is_active": procedure[7],
+        "metadata": procedure[8]
+    }
+
+def get_procedures_from_blockchain(procedure_ids: list) -> list:
+    """Récupère plusieurs actes en un seul eth_call via Multicall3 (appels unitaires en repli)"""
+    if contract is None:
+        init_web3()
+    
+    # Seuls les actes absents du cache sont lus sur la blockchain
+    with _cache_lock:
+        procedures = {proc_id: _procedure_cache.get(proc_id) for proc_id in procedure_ids}
+    missing_ids = [proc_id for proc_id, procedure in procedures.items() if procedure is None]
+    
+    if missing_ids:
+        try:
+            calls = [
+                (contract.address, True, _encode_get_procedure(proc_id))
+                for proc_id in missing_ids
+            ]
+            results = multicall.functions.aggregate3(calls).call()
+            
+            for proc_id, (success, return_data) in zip(missing_ids, results):
+                if success:
+                    procedures[proc_id] = _cache_procedure(format_procedure(_decode_procedure(return_data)))
+            
+        except Exception as e:
+            # Multicall3 absent du réseau (ex. nœud Hardhat local) : un appel par acte
+            print(f"Multicall indisponible, lecture acte par acte: {e}")
+            for proc_id in missing_ids:
+                procedures[proc_id] = get_procedure_from_blockchain(proc_id)
+    
+    return [procedure for procedure in procedures.values() if procedure]
+
 def get_procedure_from_blockchain(procedure_id: int) -> Optional[Dict[str, Any]]:
-    """Récupère un acte depuis la blockchain"""
+    """Récupère un acte depuis la blockchain (mis en cache, un acte enregistré est immuable)"""
     if contract is None:
         init_web3()
     
+    with _cache_lock:
+        procedure = _procedure_cache.get(procedure_id)
+    if procedure is not None:
+        return procedure
+    
     try:
-        procedure = contract.functions.getProcedure(procedure_id).call()
+        return_data = web3.eth.call({
+            "to": contract.address,
+            "data": _encode_get_procedure(procedure_id)
+        })
         
-        return {
-            "id": procedure[0],
-            "patient_id": procedure[1],
-            "practitioner": procedure[2],
-            "procedure_type": procedure[3],
-            "duration": procedure[4],
-            "timestamp": procedure[5],
-            "consent_hash": procedure[6],
-            "is_active": procedure[7],
-            "metadata": procedure[8]
-        }
+        return _cache_procedure(format_procedure(_decode_procedure(return_data)))
         
     except Exception as e:
         print(f"Erreur lors de la récupération de l'acte {procedure_id}: {e}")
         return None
 
-def get_patient_procedures_from_blockchain(patient_hash: str) -> list:
-    """Récupère tous les actes d'un patient depuis la blockchain"""
+def get_patient_procedure_ids(patient_hash: str) -> list:
+    """Récupère les IDs des actes d'un patient depuis la blockchain"""
     if contract is None:
         init_web3()
     
     try:
-        procedure_ids = contract.functions.getPatientProcedures(patient_hash).call()
-        procedures = []
-        
-        for proc_id in procedure_ids:
-            procedure = get_procedure_from_blockchain(proc_id)
-            if procedure:
-                procedures.append(procedure)
-        
-        return procedures
+        return _get_procedure_ids("patient", patient_hash, contract.functions.getPatientProcedures)
         
     except Exception as e:
         print(f"Erreur lors de la récupération des actes du patient {patient_hash}: {e}")
         return []
 
+def get_patient_procedures_from_blockchain(patient_hash: str) -> list:
+    """Récupère tous les actes d'un patient depuis la blockchain"""
+    return get_procedures_from_blockchain(get_patient_procedure_ids(patient_hash))
+
 def get_practitioner_procedures_from_blockchain(practitioner_address: str) -> list:
     """Récupère tous les actes d'un praticien depuis la blockchain"""
     if contract is None:
         init_web3()
     
     try:
-        procedure_ids = contract.functions.getPractitionerProcedures(practitioner_address).call()
-        procedures = []
-        
-        for proc_id in procedure_ids:
-            procedure = get_procedure_from_blockchain(proc_id)
-            if procedure:
-                procedures.append(procedure)
-        
-        return procedures
+        procedure_ids = _get_procedure_ids(
+            "practitioner", practitioner_address, contract.functions.getPractitionerProcedures
+        )
+        return get_procedures_from_blockchain(procedure_ids)
         
     except Exception as e:
         print(f"Erreur lors de la récupération des actes du praticien {practitioner_address}: {e}")
@@ -4,157 +4,240 @@ Conforme aux standards HL7 FHIR R4 pour les claims et ressources médicales
 """
 
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+import functools
 import hashlib
+import sys
+import time
+
+try:
+    import orjson
+except ImportError:  # orjson est optionnel : repli sur la bibliothèque standard
+    import json
+    orjson = None
+
+try:
+    import cbor2
+except ImportError:  # cbor2 est optionnel : seul le format CBOR en dépend
+    cbor2 = None
+
+def _dumps(data) -> bytes:
+    """Sérialise des données en JSON (orjson si disponible)"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, default=str).encode()
+
+# Types MIME des ressources FHIR sérialisées (JSON, CBOR)
+FHIR_JSON_MEDIA_TYPE = "application/fhir+json"
+FHIR_CBOR_MEDIA_TYPE = "application/fhir+cbor"
+
+def _bundle_fingerprint(resources: list) -> str:
+    """Empreinte courte d'un bundle, calculée au fil des couples (resourceType, id)"""
+    # Toujours blake2b : l'ID d'un bundle ne doit pas dépendre des modules installés
+    digest = hashlib.blake2b(digest_size=4)
+    for resource in resources:
+        digest.update(f"{resource['resourceType']}/{resource['id']}\n".encode())
+    return digest.hexdigest()[:8]
+
+# Dernier horodatage formaté : [seconde epoch, chaîne ISO]
+_timestamp_cache = [0, ""]
+
+def _utcnow_iso() -> str:
+    """Horodatage UTC ISO à la seconde, reformaté seulement quand la seconde change"""
+    seconds = time.time_ns() // 1_000_000_000
+    cached = _timestamp_cache
+    if cached[0] != seconds:
+        # Une course entre threads ne peut donner qu'un horodatage de la seconde précédente
+        cached[1] = datetime.utcfromtimestamp(seconds).isoformat()
+        cached[0] = seconds
+    return cached[1]
+
+# URI des systèmes de codage et extensions, internées une seule fois pour être
+# partagées (et comparées par identité) dans toutes les ressources produites
+_SNOMED_SYSTEM = sys.intern("http://snomed.info/sct")
+_CLAIM_TYPE_SYSTEM = sys.intern("http://terminology.hl7.org/CodeSystem/claim-type")
+_PROCESS_PRIORITY_SYSTEM = sys.intern("http://terminology.hl7.org/CodeSystem/processpriority")
+_CLAIM_INFO_CATEGORY_SYSTEM = sys.intern("http://terminology.hl7.org/CodeSystem/claim-informationcategory")
+_CONFIDENTIALITY_SYSTEM = sys.intern("http://terminology.hl7.org/CodeSystem/v3-Confidentiality")
+_PRACTITIONER_ROLE_SYSTEM = sys.intern("http://terminology.hl7.org/CodeSystem/practitioner-role")
+_ACT_CODE_SYSTEM = sys.intern("http://terminology.hl7.org/CodeSystem/v3-ActCode")
+_PATIENT_ID_SYSTEM = sys.intern("http://radiology-dapp.com/patient")
+_PRACTITIONER_ID_SYSTEM = sys.intern("http://radiology-dapp.com/practitioner")
+_QUALIFICATION_SYSTEM = sys.intern("http://radiology-dapp.com/qualification")
+_BLOCKCHAIN_TX_EXTENSION_URL = sys.intern("http://radiology-dapp.com/blockchain-transaction")
+_WALLET_ADDRESS_EXTENSION_URL = sys.intern("http://radiology-dapp.com/wallet-address")
 
 # Codes SNOMED CT pour les procédures de radiologie interventionnelle
 SNOMED_PROCEDURE_CODES = {
     "embolisation": {
         "code": "433144002",
         "display": "Embolization procedure",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "ponction": {
         "code": "261190007",
         "display": "Percutaneous puncture",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "stent": {
         "code": "384692006",
         "display": "Insertion of stent",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "angioplastie": {
         "code": "372024009",
         "display": "Angioplasty",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "biopsie": {
         "code": "387713003",
         "display": "Surgical biopsy",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "drainage": {
         "code": "174250002",
         "display": "Drainage procedure",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "ablation": {
         "code": "713295009",
         "display": "Ablation",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "radiofréquence": {
         "code": "173666000",
         "display": "Radiofrequency ablation",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "cryothérapie": {
         "code": "173665001",
         "display": "Cryotherapy",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     },
     "chimioembolisation": {
         "code": "430193006",
         "display": "Chemoembolization",
-        "system": "http://snomed.info/sct"
+        "system": _SNOMED_SYSTEM
     }
 }
 
-def create_fhir_claim(procedure, patient, practitioner) -> Dict[str, Any]:
-    """
-    Crée une ressource Claim FHIR R4 pour un acte de radiologie interventionnelle
-    
-    Args:
-        procedure: Objet Procedure de la base de données
-        patient: Objet Patient de la base de données
-        practitioner: Objet User (praticien) de la base de données
-    
-    Returns:
-        Dict contenant la ressource Claim FHIR
-    """
-    
-    # Obtenir le code SNOMED pour le type de procédure
-    snomed_code = SNOMED_PROCEDURE_CODES.get(
-        procedure.procedure_type.lower(),
-        {
-            "code": "261190007",
-            "display": "Percutaneous puncture",
-            "system": "http://snomed.info/sct"
-        }
+# Codes SNOMED internés au chargement du module
+for _snomed_code in SNOMED_PROCEDURE_CODES.values():
+    _snomed_code["code"] = sys.intern(_snomed_code["code"])
+del _snomed_code
+
+# Code utilisé pour les types de procédure inconnus (partagé, ne pas modifier)
+_DEFAULT_SNOMED = SNOMED_PROCEDURE_CODES["ponction"]
+
+# Sous-arbres constants du Claim, construits une seule fois et partagés par
+# référence entre toutes les ressources (lecture seule : ne pas modifier)
+_CLAIM_TYPE = {
+    "coding": [{
+        "system": _CLAIM_TYPE_SYSTEM,
+        "code": "institutional",
+        "display": "Institutional"
+    }]
+}
+
+_CLAIM_PRIORITY = {
+    "coding": [{
+        "system": _PROCESS_PRIORITY_SYSTEM,
+        "code": "normal",
+        "display": "Normal"
+    }]
+}
+
+_CARE_TEAM_SEQUENCE = [1]
+
+# Quantité et total des Claims (partagés entre toutes les ressources, lecture seule)
+_QUANTITY_ONE_PROCEDURE = {"value": 1, "unit": "procedure"}
+_TOTAL_EUR_ZERO = {"currency": "EUR", "value": 0}  # À calculer selon la tarification
+
+# Catégorie "consentement" des supportingInfo (partagée, lecture seule)
+_CONSENT_CATEGORY = {
+    "coding": [{
+        "system": _CLAIM_INFO_CATEGORY_SYSTEM,
+        "code": "consent",
+        "display": "Consent"
+    }]
+}
+
+# Champs requis d'un Claim (tuple pour l'ordre des messages, frozenset pour le test rapide)
+_REQUIRED_CLAIM_FIELDS = ("resourceType", "id", "status", "type", "patient", "provider")
+_REQUIRED_CLAIM_FIELD_SET = frozenset(_REQUIRED_CLAIM_FIELDS)
+
+# Champs requis de chaque procédure d'un Claim, avec leur message d'erreur
+_REQUIRED_PROCEDURE_FIELDS = (
+    ("sequence", "Sequence manquante pour la procédure {}"),
+    ("procedureCodeableConcept", "procedureCodeableConcept manquant pour la procédure {}")
+)
+_REQUIRED_PROCEDURE_FIELD_SET = frozenset(field for field, _ in _REQUIRED_PROCEDURE_FIELDS)
+
+# Status autorisés d'un Claim
+_VALID_CLAIM_STATUSES = frozenset({"active", "cancelled", "draft", "entered-in-error"})
+
+# Mode de recherche des entrées de Bundle (partagé entre les entrées, lecture seule)
+_SEARCH_MATCH = {"mode": "match"}
+
+def _patient_claim_refs(patient_hash: str) -> tuple:
+    """Références patient et couverture d'un Claim (communes à tous les actes du patient)"""
+    phash8 = patient_hash[:8]
+    return (
+        {"reference": f"Patient/{patient_hash}", "display": f"Patient {phash8}..."},
+        {"reference": f"Coverage/coverage-{phash8}"}
     )
+
+def _provider_ref(practitioner) -> Dict[str, Any]:
+    """Référence Practitioner d'un Claim"""
+    return {
+        "reference": f"Practitioner/{practitioner.id}",
+        "display": practitioner.username
+    }
+
+def _build_claim(procedure, coding: list, patient_ref: Dict[str, Any],
+                 coverage_ref: Dict[str, Any], provider: Dict[str, Any]) -> Dict[str, Any]:
+    """Assemble un Claim à partir des valeurs précalculées (références partagées, lecture seule)"""
+    # Valeurs réutilisées plusieurs fois dans la ressource
+    created_iso = procedure.created_at.isoformat()
+    updated_iso = procedure.updated_at.isoformat()
     
     # Créer la ressource Claim
     claim = {
         "resourceType": "Claim",
         "id": f"claim-{procedure.id}",
         "status": "active",
-        "type": {
-            "coding": [{
-                "system": "http://terminology.hl7.org/CodeSystem/claim-type",
-                "code": "institutional",
-                "display": "Institutional"
-            }]
-        },
+        "type": _CLAIM_TYPE,
         "use": "claim",
-        "patient": {
-            "reference": f"Patient/{patient.patient_hash}",
-            "display": f"Patient {patient.patient_hash[:8]}..."
-        },
-        "created": procedure.created_at.isoformat(),
-        "provider": {
-            "reference": f"Practitioner/{practitioner.id}",
-            "display": practitioner.username
-        },
-        "priority": {
-            "coding": [{
-                "system": "http://terminology.hl7.org/CodeSystem/processpriority",
-                "code": "normal",
-                "display": "Normal"
-            }]
-        },
+        "patient": patient_ref,
+        "created": created_iso,
+        "provider": provider,
+        "priority": _CLAIM_PRIORITY,
         "procedure": [{
             "sequence": 1,
             "procedureCodeableConcept": {
-                "coding": [{
-                    "system": snomed_code["system"],
-                    "code": snomed_code["code"],
-                    "display": snomed_code["display"]
-                }],
+                "coding": coding,
                 "text": procedure.procedure_type
             },
-            "date": procedure.created_at.isoformat()
+            "date": created_iso
         }],
         "insurance": [{
             "sequence": 1,
             "focal": True,
-            "coverage": {
-                "reference": f"Coverage/coverage-{patient.patient_hash[:8]}"
-            }
+            "coverage": coverage_ref
         }],
         "item": [{
             "sequence": 1,
-            "careTeamSequence": [1],
+            "careTeamSequence": _CARE_TEAM_SEQUENCE,
             "productOrService": {
-                "coding": [{
-                    "system": snomed_code["system"],
-                    "code": snomed_code["code"],
-                    "display": snomed_code["display"]
-                }]
+                "coding": coding
             },
-            "servicedDate": procedure.created_at.isoformat(),
-            "quantity": {
-                "value": 1,
-                "unit": "procedure"
-            }
+            "servicedDate": created_iso,
+            "quantity": _QUANTITY_ONE_PROCEDURE
         }],
-        "total": {
-            "currency": "EUR",
-            "value": 0  # À calculer selon la tarification
-        },
+        "total": _TOTAL_EUR_ZERO,
         "meta": {
             "versionId": "1",
-            "lastUpdated": procedure.updated_at.isoformat(),
+            "lastUpdated": updated_iso,
             "source": "#radiology-dapp"
         }
     }
@@ -162,7 +245,7 @@ def create_fhir_claim(procedure, patient, practitioner) -> Dict[str, Any]:
     # Ajouter les métadonnées blockchain si disponibles
     if procedure.blockchain_tx_hash:
         claim["meta"]["extension"] = [{
-            "url": "http://radiology-dapp.com/blockchain-transaction",
+            "url": _BLOCKCHAIN_TX_EXTENSION_URL,
             "valueString": procedure.blockchain_tx_hash
         }]
     
@@ -170,18 +253,83 @@ def create_fhir_claim(procedure, patient, practitioner) -> Dict[str, Any]:
     if procedure.consent_hash:
         claim["supportingInfo"] = [{
             "sequence": 1,
-            "category": {
-                "coding": [{
-                    "system": "http://terminology.hl7.org/CodeSystem/claim-informationcategory",
-                    "code": "consent",
-                    "display": "Consent"
-                }]
-            },
+            "category": _CONSENT_CATEGORY,
             "valueString": procedure.consent_hash
         }]
     
     return claim
 
+@functools.lru_cache(maxsize=32)
+def _claim_builder_for(procedure_type: str):
+    """Crée, une fois par type de procédure, un assembleur de Claim au codage SNOMED pré-construit"""
+    snomed_code = get_snomed_code(procedure_type)
+    
+    # Liste de codage partagée par tous les Claims de ce type, référencée à la fois par
+    # procedureCodeableConcept et productOrService (lecture seule : ne pas modifier)
+    coding = [{
+        "system": snomed_code["system"],
+        "code": snomed_code["code"],
+        "display": snomed_code["display"]
+    }]
+    
+    def build(procedure, patient_ref, coverage_ref, provider) -> Dict[str, Any]:
+        return _build_claim(procedure, coding, patient_ref, coverage_ref, provider)
+    
+    return build
+
+def create_fhir_claim(procedure, patient, practitioner) -> Dict[str, Any]:
+    """
+    Crée une ressource Claim FHIR R4 pour un acte de radiologie interventionnelle
+    
+    Args:
+        procedure: Objet Procedure de la base de données
+        patient: Objet Patient de la base de données
+        practitioner: Objet User (praticien) de la base de données
+    
+    Returns:
+        Dict contenant la ressource Claim FHIR
+    """
+    
+    # Assembleur spécialisé pour le type de procédure (codage SNOMED déjà construit)
+    build = _claim_builder_for(procedure.procedure_type)
+    patient_ref, coverage_ref = _patient_claim_refs(patient.patient_hash)
+    
+    return build(procedure, patient_ref, coverage_ref, _provider_ref(practitioner))
+
+def create_fhir_claims_batch(procedures: list, patient, practitioners: Dict[int, Any]) -> list:
+    """
+    Crée les ressources Claim FHIR R4 de plusieurs actes d'un même patient
+    
+    Les références patient/couverture et les références des praticiens sont calculées
+    une seule fois pour tout le lot (le codage SNOMED l'est une fois par type).
+    
+    Args:
+        procedures: Objets Procedure du patient
+        patient: Objet Patient de la base de données
+        practitioners: Praticiens (objets User) indexés par ID
+    
+    Returns:
+        Liste des ressources Claim FHIR (les actes sans praticien connu sont ignorés)
+    """
+    
+    patient_ref, coverage_ref = _patient_claim_refs(patient.patient_hash)
+    providers = {}
+    claims = []
+    
+    for procedure in procedures:
+        practitioner_id = procedure.practitioner_id
+        provider = providers.get(practitioner_id)
+        if provider is None:
+            practitioner = practitioners.get(practitioner_id)
+            if practitioner is None:
+                continue
+            provider = providers[practitioner_id] = _provider_ref(practitioner)
+        
+        build = _claim_builder_for(procedure.procedure_type)
+        claims.append(build(procedure, patient_ref, coverage_ref, provider))
+    
+    return claims
+
 def create_fhir_patient(patient) -> Dict[str, Any]:
     """
     Crée une ressource Patient FHIR R4 (pseudonymisée)
@@ -193,12 +341,17 @@ def create_fhir_patient(patient) -> Dict[str, Any]:
         Dict contenant la ressource Patient FHIR
     """
     
+    phash = patient.patient_hash
+    return _build_patient(patient, phash, phash[:8])
+
+def _build_patient(patient, phash: str, phash8: str) -> Dict[str, Any]:
+    """Assemble la ressource Patient à partir du hash et de son préfixe déjà calculés"""
     patient_resource = {
         "resourceType": "Patient",
-        "id": patient.patient_hash,
+        "id": phash,
         "identifier": [{
-            "system": "http://radiology-dapp.com/patient",
-            "value": patient.patient_hash
+            "system": _PATIENT_ID_SYSTEM,
+            "value": phash
         }],
         "active": True,
         "meta": {
@@ -207,7 +360,7 @@ def create_fhir_patient(patient) -> Dict[str, Any]:
             "source": "#radiology-dapp",
             "security": [{
                 "coding": [{
-                    "system": "http://terminology.hl7.org/CodeSystem/v3-Confidentiality",
+                    "system": _CONFIDENTIALITY_SYSTEM,
                     "code": "R",
                     "display": "Restricted"
                 }]
@@ -219,7 +372,7 @@ def create_fhir_patient(patient) -> Dict[str, Any]:
     if patient.first_name_hash:
         patient_resource["name"] = [{
             "use": "official",
-            "text": f"Patient {patient.patient_hash[:8]}..."
+            "text": f"Patient {phash8}..."
         }]
     
     return patient_resource
@@ -235,12 +388,16 @@ def create_fhir_practitioner(practitioner) -> Dict[str, Any]:
         Dict contenant la ressource Practitioner FHIR
     """
     
+    return _build_practitioner(practitioner, str(practitioner.id))
+
+def _build_practitioner(practitioner, practitioner_id: str) -> Dict[str, Any]:
+    """Assemble la ressource Practitioner à partir de son ID déjà converti en chaîne"""
     practitioner_resource = {
         "resourceType": "Practitioner",
-        "id": str(practitioner.id),
+        "id": practitioner_id,
         "identifier": [{
-            "system": "http://radiology-dapp.com/practitioner",
-            "value": str(practitioner.id)
+            "system": _PRACTITIONER_ID_SYSTEM,
+            "value": practitioner_id
         }],
         "active": practitioner.is_active,
         "name": [{
@@ -254,12 +411,12 @@ def create_fhir_practitioner(practitioner) -> Dict[str, Any]:
         }],
         "qualification": [{
             "identifier": [{
-                "system": "http://radiology-dapp.com/qualification",
+                "system": _QUALIFICATION_SYSTEM,
                 "value": practitioner.role
             }],
             "code": {
                 "coding": [{
-                    "system": "http://terminology.hl7.org/CodeSystem/practitioner-role",
+                    "system": _PRACTITIONER_ROLE_SYSTEM,
                     "code": "doctor",
                     "display": "Doctor"
                 }]
@@ -278,7 +435,7 @@ def create_fhir_practitioner(practitioner) -> Dict[str, Any]:
     # Ajouter l'adresse wallet si disponible
     if practitioner.wallet_address:
         practitioner_resource["extension"] = [{
-            "url": "http://radiology-dapp.com/wallet-address",
+            "url": _WALLET_ADDRESS_EXTENSION_URL,
             "valueString": practitioner.wallet_address
         }]
     
@@ -296,38 +453,82 @@ def create_fhir_coverage(patient_hash: str, insurance_info: Optional[Dict] = Non
         Dict contenant la ressource Coverage FHIR
     """
     
+    coverage = _build_coverage(f"Patient/{patient_hash}", f"coverage-{patient_hash[:8]}")
+    
+    if insurance_info:
+        coverage.update(insurance_info)
+    
+    return coverage
+
+def _build_coverage(patient_reference: str, coverage_id: str) -> Dict[str, Any]:
+    """Assemble la ressource Coverage à partir des références déjà calculées"""
+    now_iso = _utcnow_iso()
+    
     coverage = {
         "resourceType": "Coverage",
-        "id": f"coverage-{patient_hash[:8]}",
+        "id": coverage_id,
         "status": "active",
         "type": {
             "coding": [{
-                "system": "http://terminology.hl7.org/CodeSystem/v3-ActCode",
+                "system": _ACT_CODE_SYSTEM,
                 "code": "EHCPOL",
                 "display": "extended healthcare"
             }]
         },
         "subscriber": {
-            "reference": f"Patient/{patient_hash}"
+            "reference": patient_reference
         },
         "beneficiary": {
-            "reference": f"Patient/{patient_hash}"
+            "reference": patient_reference
         },
         "period": {
-            "start": datetime.utcnow().isoformat()
+            "start": now_iso
         },
         "meta": {
             "versionId": "1",
-            "lastUpdated": datetime.utcnow().isoformat(),
+            "lastUpdated": now_iso,
             "source": "#radiology-dapp"
         }
     }
     
-    if insurance_info:
-        coverage.update(insurance_info)
-    
     return coverage
 
+def create_fhir_entities(procedure, patient, practitioner) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """
+    Crée en une passe les ressources Claim, Patient, Practitioner et Coverage d'un acte
+    
+    Les valeurs communes (hash patient, références, ID praticien) ne sont calculées
+    qu'une fois et partagées entre les quatre ressources.
+    
+    Args:
+        procedure: Objet Procedure de la base de données
+        patient: Objet Patient de la base de données
+        practitioner: Objet User (praticien) de la base de données
+    
+    Returns:
+        Tuple (Claim, Patient, Practitioner, Coverage) de ressources FHIR
+    """
+    
+    phash = patient.patient_hash
+    phash8 = phash[:8]
+    patient_reference = "Patient/" + phash
+    coverage_id = "coverage-" + phash8
+    practitioner_id = str(practitioner.id)
+    
+    claim = _claim_builder_for(procedure.procedure_type)(
+        procedure,
+        {"reference": patient_reference, "display": f"Patient {phash8}..."},
+        {"reference": "Coverage/" + coverage_id},
+        {"reference": "Practitioner/" + practitioner_id, "display": practitioner.username}
+    )
+    
+    return (
+        claim,
+        _build_patient(patient, phash, phash8),
+        _build_practitioner(practitioner, practitioner_id),
+        _build_coverage(patient_reference, coverage_id)
+    )
+
 def create_fhir_bundle(resources: list, bundle_type: str = "collection") -> Dict[str, Any]:
     """
     Crée un Bundle FHIR R4
@@ -342,25 +543,69 @@ def create_fhir_bundle(resources: list, bundle_type: str = "collection") -> Dict
     
     bundle = {
         "resourceType": "Bundle",
-        "id": f"bundle-{hashlib.md5(str(resources).encode()).hexdigest()[:8]}",
+        "id": f"bundle-{_bundle_fingerprint(resources)}",
         "type": bundle_type,
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": _utcnow_iso(),
         "total": len(resources),
-        "entry": []
-    }
-    
-    for i, resource in enumerate(resources):
-        entry = {
-            "fullUrl": f"{resource['resourceType']}/{resource['id']}",
-            "resource": resource,
-            "search": {
-                "mode": "match"
+        "entry": [
+            {
+                "fullUrl": f"{resource['resourceType']}/{resource['id']}",
+                "resource": resource,
+                "search": _SEARCH_MATCH
             }
-        }
-        bundle["entry"].append(entry)
+            for resource in resources
+        ]
+    }
     
     return bundle
 
+def create_fhir_bundle_bytes(resources: list, bundle_type: str = "collection") -> bytes:
+    """
+    Crée un Bundle FHIR R4 directement sérialisé en JSON
+    
+    Args:
+        resources: Liste des ressources FHIR
+        bundle_type: Type de bundle (collection, searchset, etc.)
+    
+    Returns:
+        Bundle FHIR encodé en JSON (bytes, à servir en application/fhir+json)
+    """
+    
+    return _dumps(create_fhir_bundle(resources, bundle_type))
+
+def create_fhir_bundle_cbor(resources: list, bundle_type: str = "collection") -> bytes:
+    """
+    Crée un Bundle FHIR R4 sérialisé en CBOR (charge utile binaire plus compacte)
+    
+    Args:
+        resources: Liste des ressources FHIR
+        bundle_type: Type de bundle (collection, searchset, etc.)
+    
+    Returns:
+        Bundle FHIR encodé en CBOR (bytes, à servir en application/fhir+cbor)
+    """
+    
+    if cbor2 is None:
+        raise ImportError("Le module cbor2 est requis pour la sérialisation CBOR")
+    
+    return cbor2.dumps(create_fhir_bundle(resources, bundle_type))
+
+def parse_fhir_bundle_cbor(data: bytes) -> Dict[str, Any]:
+    """
+    Décode un Bundle FHIR R4 sérialisé en CBOR
+    
+    Args:
+        data: Bundle FHIR encodé en CBOR
+    
+    Returns:
+        Dict contenant le Bundle FHIR
+    """
+    
+    if cbor2 is None:
+        raise ImportError("Le module cbor2 est requis pour la sérialisation CBOR")
+    
+    return cbor2.loads(data)
+
 def validate_fhir_claim(claim: Dict[str, Any]) -> Dict[str, Any]:
     """
     Valide une ressource Claim FHIR
@@ -376,27 +621,29 @@ def validate_fhir_claim(claim: Dict[str, Any]) -> Dict[str, Any]:
     warnings = []
     
     # Vérifier les champs requis
-    required_fields = ["resourceType", "id", "status", "type", "patient", "provider"]
-    for field in required_fields:
-        if field not in claim:
-            errors.append(f"Champ requis manquant: {field}")
+    if not _REQUIRED_CLAIM_FIELD_SET.issubset(claim):
+        errors.extend(
+            f"Champ requis manquant: {field}"
+            for field in _REQUIRED_CLAIM_FIELDS
+            if field not in claim
+        )
     
     # Vérifier le resourceType
     if claim.get("resourceType") != "Claim":
         errors.append("resourceType doit être 'Claim'")
     
     # Vérifier le status
-    valid_statuses = ["active", "cancelled", "draft", "entered-in-error"]
-    if claim.get("status") not in valid_statuses:
-        errors.append(f"Status invalide. Valeurs autorisées: {valid_statuses}")
+    if claim.get("status") not in _VALID_CLAIM_STATUSES:
+        errors.append(f"Status invalide. Valeurs autorisées: {sorted(_VALID_CLAIM_STATUSES)}")
     
     # Vérifier la structure des procédures
-    if "procedure" in claim:
-        for i, procedure in enumerate(claim["procedure"]):
-            if "sequence" not in procedure:
-                errors.append(f"Sequence manquante pour la procédure {i}")
-            if "procedureCodeableConcept" not in procedure:
-                errors.append(f"procedureCodeableConcept manquant pour la procédure {i}")
+    for i, procedure in enumerate(claim.get("procedure", ())):
+        if not _REQUIRED_PROCEDURE_FIELD_SET.issubset(procedure):
+            errors.extend(
+                message.format(i)
+                for field, message in _REQUIRED_PROCEDURE_FIELDS
+                if field not in procedure
+            )
     
     return {
         "valid": len(errors) == 0,
@@ -415,11 +662,8 @@ def get_snomed_code(procedure_type: str) -> Dict[str, str]:
         Dict avec le code SNOMED
     """
     
-    return SNOMED_PROCEDURE_CODES.get(
-        procedure_type.lower(),
-        {
-            "code": "261190007",
-            "display": "Percutaneous puncture",
-            "system": "http://snomed.info/sct"
-        }
+    # Les types validés par le schéma sont déjà en minuscules : .lower() seulement en cas d'échec
+    return (
+        SNOMED_PROCEDURE_CODES.get(procedure_type)
+        or SNOMED_PROCEDURE_CODES.get(procedure_type.lower(), _DEFAULT_SNOMED)
     )
\ No newline at end of file